@@ -1,113 +1,338 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask.json.provider import JSONProvider
 import firebase_admin
 from firebase_admin import credentials, firestore
 import google.generativeai as genai
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+import orjson
 import os
-from rapidfuzz import fuzz
+import textwrap
+import threading
+import unicodedata
+from datetime import datetime
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache, cached
+from cachetools.keys import hashkey
+import numpy as np
+from rapidfuzz import fuzz, process
+
+
+def _orjson_default(obj):
+    """Serialize types orjson does not handle natively."""
+    if isinstance(obj, datetime):  # e.g. Firestore DatetimeWithNanoseconds
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class ORJSONProvider(JSONProvider):
+    """Flask JSON provider backed by orjson."""
+
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_orjson_default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=_orjson_default, option=self.option)
+        return self._app.response_class(body, mimetype="application/json")
+
 
 # Initialize Flask
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 
 # Load API Keys from Environment Variables
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-flash-latest")
 SERPER_API_KEY = os.getenv("SERPER_API_KEY")
 SERPER_URL = "https://google.serper.dev/search"
 
+# Pooled HTTP session so Serper calls reuse TCP/TLS connections
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=32, pool_maxsize=32,
+    max_retries=Retry(total=2, backoff_factor=0.2),
+))
+
 # Initialize Firebase (Ensure correct credentials loading)
 firebase_credentials = os.getenv("FIREBASE_CREDENTIALS")
 if firebase_credentials:
-    cred = credentials.Certificate(json.loads(firebase_credentials))
+    cred = credentials.Certificate(orjson.loads(firebase_credentials))
     firebase_admin.initialize_app(cred)
 else:
     raise ValueError("Firebase credentials not found!")
 
 db = firestore.client()
 
-# Configure Google Gemini API
+# Configure Google Gemini API and build the model once for all requests
 genai.configure(api_key=GEMINI_API_KEY)
+GEMINI_MODEL = genai.GenerativeModel(
+    GEMINI_MODEL_NAME,
+    generation_config=genai.GenerationConfig(max_output_tokens=512),
+)
+
+# Short-lived caches for repeated (location, problem) lookups.
+# Complaint search expires quickly so new complaints surface; Gemini output is the most expensive to recompute.
+COMPLAINTS_CACHE = TTLCache(maxsize=2048, ttl=60)
+NEWS_CACHE = TTLCache(maxsize=2048, ttl=900)
+SUMMARY_CACHE = TTLCache(maxsize=1024, ttl=3600)
+SUMMARY_LOCK = threading.Lock()
+
+# Upper bound on complaints scanned per search. At this size the cdist call (workers=-1, GIL released)
+# is already spread over all cores, so sharding across a process pool would only add pickling overhead.
+COMPLAINT_SCAN_LIMIT = 500
+
+
+def _call(func, *args, no_cache=False):
+    """Call a cached function, skipping its cache when no_cache is set."""
+    return func.__wrapped__(*args) if no_cache else func(*args)
+
 
+@lru_cache(maxsize=4096)
+def _norm_loc(location):
+    """Canonical form of a location name: NFKC-normalized, stripped and title-cased."""
+    return unicodedata.normalize("NFKC", location).strip().title()
 
-def search_firebase(location, problem, threshold=70):
-    """Search for complaints in Firebase that match the given location and problem."""
-    location = location.strip().title()
+
+def _sort_tokens(text):
+    """Lowercase a text, then split and sort its words the way token_sort_ratio preprocesses it."""
+    return " ".join(sorted(text.lower().split()))
+
+
+def build_complaint(location, text):
+    """Build the Firestore document for a new complaint, including precomputed match fields.
+
+    Anything that writes to the "complaints" collection must store this document so search_firebase's
+    indexed query finds it; complaints written before these fields existed are filled in by backfill_complaints.py.
+    """
+    return {
+        "location": location.strip(),
+        "location_key": _norm_loc(location),
+        "created_at": firestore.SERVER_TIMESTAMP,
+        "text": text,
+        "text_sorted": _sort_tokens(text),
+    }
+
+
+@cached(COMPLAINTS_CACHE,
+        key=lambda location, problem, *args, **kwargs: hashkey(location, problem.lower(), *args, **kwargs),
+        lock=threading.Lock())
+def search_firebase(location, problem, threshold=70, limit=20):
+    """Search for complaints in Firebase that match the given (already normalized) location and problem."""
     complaints_ref = db.collection("complaints")
     
-    query = complaints_ref.where("location", ">=", location).where("location", "<=", location + "\uf8ff")
+    # Equality on the normalized key (backed by the composite index in firestore.indexes.json)
+    # keeps the scan to the most recent complaints for this location only.
+    query = (
+        complaints_ref.where("location_key", "==", location)
+        .order_by("created_at", direction=firestore.Query.DESCENDING)
+        .limit(COMPLAINT_SCAN_LIMIT)
+    )
     results = list(query.stream())
+    if not results:
+        # Complaints stored without location_key/created_at are only reachable through the original prefix range
+        legacy_query = (
+            complaints_ref.where("location", ">=", location)
+            .where("location", "<=", location + "\uf8ff")
+            .limit(COMPLAINT_SCAN_LIMIT)
+        )
+        results = list(legacy_query.stream())
 
-    matched_complaints = []
+    # Stored complaints carry pre-sorted tokens, so plain ratio is equivalent to token_sort_ratio.
+    # An Indel ratio of t needs shorter/longer >= t / (200 - t), so texts outside that length band
+    # cannot reach the threshold and are skipped before the batched C++ scoring call.
+    problem_sorted = _sort_tokens(problem)
+    band = threshold / (200 - threshold)
+    min_len = band * len(problem_sorted)
+    max_len = len(problem_sorted) / band if band else float("inf")
+    docs, texts = [], []
     for complaint in results:
         data = complaint.to_dict()
-        similarity_score = fuzz.token_sort_ratio(problem.lower(), data["text"].lower())
-        if similarity_score >= threshold:
-            matched_complaints.append({**data, "similarity": similarity_score})
+        # Storage-only match fields are not part of the API response
+        data.pop("location_key", None)
+        text_sorted = data.pop("text_sorted", None) or _sort_tokens(data["text"])
+        if min_len <= len(text_sorted) <= max_len:
+            docs.append(data)
+            texts.append(text_sorted)
+    if not docs:
+        return []
+
+    scores = process.cdist(
+        [problem_sorted], texts,
+        scorer=fuzz.ratio, score_cutoff=threshold,
+        workers=-1, dtype=np.uint8,
+    )[0]
+
+    # Scores stay in the uint8 array; only the top `limit` complaints are returned to the client
+    # A stable sort keeps equal scores in query order (newest first); with at most
+    # COMPLAINT_SCAN_LIMIT rows a full sort costs no more than a partial selection.
+    idx = np.flatnonzero(scores >= threshold)
+    idx = idx[np.argsort(-scores[idx].astype(np.int16), kind="stable")][:limit]
 
-    matched_complaints.sort(key=lambda x: x["similarity"], reverse=True)
+    # docs are fresh to_dict() copies, so tag them in place rather than copying each one
+    matched_complaints = []
+    for i in idx:
+        data = docs[i]
+        data["similarity"] = int(scores[i])
+        matched_complaints.append(data)
     return matched_complaints
 
 
-def search_online(location, problem):
-    """Search online for news related to the given problem and location."""
+@cached(NEWS_CACHE, key=lambda location, problem: hashkey(location, problem.lower()), lock=threading.Lock())
+def _fetch_news(location, problem):
+    """Query Serper for news related to the given problem and location."""
     headers = {"X-API-KEY": SERPER_API_KEY, "Content-Type": "application/json"}
     query = f"{problem} in {location}"
     data = {"q": query, "num": 5}
 
-    response = requests.post(SERPER_URL, headers=headers, data=json.dumps(data))
+    response = SESSION.post(SERPER_URL, headers=headers, data=orjson.dumps(data), timeout=5)
     
     if response.status_code == 200:
-        results = response.json().get("organic", [])
+        results = orjson.loads(response.content).get("organic", [])
         return [
             {"title": r.get("title", "No Title"), "link": r.get("link", "#"), "snippet": r.get("snippet", "No snippet available.")}
             for r in results
         ]
-    
+
+    # Raise so search_online returns [] without the failure being cached for the news TTL
+    response.raise_for_status()
     return []
 
 
-def generate_summary(location, problem, complaints, news_results):
-    """Generate a summary using Google Gemini AI."""
-    news_text = "\n".join(
-        [f"- **{news['title']}**: {news['snippet']} ([Source]({news['link']}))" for news in news_results]
-    )
+def search_online(location, problem, no_cache=False):
+    """Search online for news related to the given problem and location."""
+    try:
+        return _call(_fetch_news, location, problem, no_cache=no_cache)
+    except requests.RequestException:
+        # HTTP, timeout and connection errors are not cached; the complaints found so far are still returned
+        return []
+
 
-    prompt = f"""
+@cached(SUMMARY_CACHE, lock=SUMMARY_LOCK)
+def _generate_content(prompt):
+    """Run a Gemini generation for the given prompt."""
+    response = GEMINI_MODEL.generate_content(prompt)
+    return response.text if response else "No summary available."
+
+
+NO_DATA_SUMMARY = "Insufficient data to analyze. No matching complaints or news were found, please refine your query."
+
+# Dedented once at import so no indentation is sent to (and billed by) Gemini
+_PROMPT = textwrap.dedent("""
     You are an expert in analyzing social issues. A complaint about "{problem}" was received in {location}.
     Below is relevant information:
 
-    - **Database complaints**: {complaints if complaints else 'None found'}
+    - **Database complaints**: {complaints}
     - **Relevant News Articles**:
-      {news_text if news_text else 'No relevant news found'}
+    {news}
 
     Please provide:
     1. Possible reasons for this issue.
     2. Suggested solutions.
     3. Additional recommendations.
-    """
+""").strip()
+
+
+def build_prompt(location, problem, complaints, news_results):
+    """Build the Gemini prompt from the matched complaints and news results."""
+    # Keep the prompt small: only the best complaints and news, with just the fields Gemini needs
+    top_complaints = [{"text": c["text"], "sim": c["similarity"]} for c in complaints[:5]]
+    complaints_text = orjson.dumps(top_complaints).decode()
+    news_text = "\n".join(
+        f"- **{news['title']}**: {news['snippet'][:200]} ([Source]({news['link']}))" for news in news_results[:3]
+    )
+
+    return _PROMPT.format(
+        problem=problem,
+        location=location,
+        complaints=complaints_text if top_complaints else "None found",
+        news=news_text if news_text else "No relevant news found",
+    )
+
 
+def generate_summary(location, problem, complaints, news_results, no_cache=False):
+    """Generate a summary using Google Gemini AI."""
+    prompt = build_prompt(location, problem, complaints, news_results)
     try:
-        model = genai.GenerativeModel("gemini-pro-latest")  # Fixed model name
-        response = model.generate_content(prompt)
-        return response.text if response else "No summary available."
+        return _call(_generate_content, prompt, no_cache=no_cache)
     except Exception as e:
         return f"Error generating summary: {str(e)}"
 
 
+def stream_summary(location, problem, complaints, news_results, no_cache=False):
+    """Yield the Gemini summary in chunks as they are generated."""
+    prompt = build_prompt(location, problem, complaints, news_results)
+    key = hashkey(prompt)
+    if not no_cache:
+        with SUMMARY_LOCK:
+            summary = SUMMARY_CACHE.get(key)
+        if summary is not None:
+            yield summary
+            return
+
+    try:
+        chunks = []
+        for chunk in GEMINI_MODEL.generate_content(prompt, stream=True):
+            chunks.append(chunk.text)
+            yield chunk.text
+        if not no_cache:
+            with SUMMARY_LOCK:
+                SUMMARY_CACHE[key] = "".join(chunks)
+    except Exception as e:
+        yield f"Error generating summary: {str(e)}"
+
+
 @app.route('/analyze', methods=['POST'])
 def analyze():
     """API endpoint to analyze complaints and provide recommendations."""
     try:
         data = request.get_json()
-        location = data.get("location", "").strip().title()
+        location = _norm_loc(data.get("location", ""))
         problem = data.get("problem", "").strip()
+        no_cache = request.args.get("no_cache") == "true"
 
         if not location or not problem:
             return jsonify({"error": "Both 'location' and 'problem' fields are required!"}), 400
 
-        complaints = search_firebase(location, problem)
-        news_results = search_online(location, problem)
-        summary = generate_summary(location, problem, complaints, news_results)
+        # Firestore and Serper are independent I/O calls, so run them concurrently
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            complaints_future = executor.submit(_call, search_firebase, location, problem, no_cache=no_cache)
+            news_future = executor.submit(search_online, location, problem, no_cache=no_cache)
+            complaints = complaints_future.result()
+            news_results = news_future.result()
+
+        # With nothing to analyze Gemini only produces a generic reply, so skip the call entirely
+        has_data = bool(complaints or news_results)
+
+        if request.args.get("stream") == "true":
+            # NDJSON stream: results first, then summary deltas for the client to concatenate
+            def generate():
+                yield app.json.dumps({
+                    "location": location,
+                    "problem": problem,
+                    "matched_complaints": complaints,
+                    "news_results": news_results,
+                }) + "\n"
+                deltas = (
+                    stream_summary(location, problem, complaints, news_results, no_cache=no_cache)
+                    if has_data else [NO_DATA_SUMMARY]
+                )
+                for delta in deltas:
+                    yield app.json.dumps({"delta": delta}) + "\n"
+
+            return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+        summary = (
+            generate_summary(location, problem, complaints, news_results, no_cache=no_cache)
+            if has_data else NO_DATA_SUMMARY
+        )
 
         return jsonify({
             "location": location,
@@ -0,0 +1,42 @@
+"""Backfill the match fields search_firebase relies on for complaints stored without them.
+
+Run once with the same environment as the API:
+    python backfill_complaints.py
+"""
+from app import build_complaint, db
+
+BATCH_SIZE = 400  # Firestore allows at most 500 writes per batch
+
+
+def backfill():
+    """Add location_key, created_at and text_sorted to every complaint that is missing them."""
+    batch = db.batch()
+    pending = updated = 0
+
+    for snapshot in db.collection("complaints").stream():
+        data = snapshot.to_dict()
+        if "location" not in data or "text" not in data:
+            continue
+
+        fields = build_complaint(data["location"], data["text"])
+        # Keep the original ordering instead of stamping every legacy complaint with "now"
+        fields["created_at"] = snapshot.create_time
+        missing = {key: value for key, value in fields.items() if key not in data}
+        if not missing:
+            continue
+
+        batch.update(snapshot.reference, missing)
+        pending += 1
+        updated += 1
+        if pending == BATCH_SIZE:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+
+    if pending:
+        batch.commit()
+    return updated
+
+
+if __name__ == "__main__":
+    print(f"Backfilled {backfill()} complaints.")
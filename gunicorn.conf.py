@@ -0,0 +1,27 @@
+import os
+
+# gevent workers multiplex the blocking Serper, Firestore and Gemini calls on greenlets,
+# so concurrent /analyze requests no longer queue behind each other's I/O.
+# Firestore and Gemini talk gRPC, which only cooperates with gevent once init_gevent() has run
+# on an already monkey-patched standard library (see post_fork below).
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+worker_class = "gevent"
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_connections = 1000
+timeout = 120
+
+# Load the app in each worker after fork so the pooled requests.Session and
+# the Firebase/Gemini clients are never shared across processes.
+preload_app = False
+
+
+def post_fork(server, worker):
+    """Make gRPC cooperate with gevent before the worker imports app.py."""
+    # gunicorn runs post_fork before the gevent worker patches the stdlib, and init_gevent()
+    # must come after patching; patching again in init_process is harmless.
+    from gevent import monkey
+    monkey.patch_all()
+
+    from grpc.experimental import gevent as grpc_gevent
+
+    grpc_gevent.init_gevent()